@@ -1,12 +1,28 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
+import gzip
+import hashlib
+import heapq
+import hmac
+import math
 import json
 import re
 import requests
 import os
+import threading
+import time
 from openai import OpenAI
 from urllib.parse import urlparse
+from email.utils import formatdate
 # Импорт парсера Fiverr гигов
-from fiverr_parser.fiverr_parser import FiverrParser
+from fiverr_parser.fiverr_parser import (FiverrParser, RequestBudget, BudgetExceeded, spool_body,
+                                         PARSE_DEADLINE, OPENAI_STAGE_TIMEOUT)
+from fiverr_parser.model_router import ModelRouter, route_stats
+from fiverr_parser.image_variants import dedupe_image_variants
+# Запись сырых ответов скрапера в корпус для офлайн-профилирования (profiling/replay.py)
+from profiling.corpus import record_payload
+# Профилирование отдельных запросов по заголовку X-Profile
+from profiling.request_profiler import (PROFILE_TOKEN, RequestProfiler, upstream_span,
+                                        save_profile, list_profiles, get_profile)
 
 # Конфигурация с поддержкой переменных окружения
 FIRECRAWL_API_KEY = os.environ.get("FIRECRAWL_API_KEY", "")
@@ -16,6 +32,47 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://hubai.loe.gg/v1")
 MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 
+# Сколько символов контента отдаём в LLM для извлечения названия/описания
+FONT_CONTENT_LIMIT = 20000
+# Поля ответа Firecrawl (`data.*`), которые читают экстракторы
+SCRAPE_FIELDS = ('html', 'markdown', 'images')
+# Фрагменты HTML, которые нужны экстракторам: meta/img/source теги, srcset и прямые ссылки на картинки
+SLIM_HTML_PATTERN = r'<meta[^>]*>|<img[^>]*>|<source[^>]*>|srcset=["\'][^"\']+["\']|https://[^"\'>\s]+\.(?:jpg|png|webp)'
+
+# Верхняя граница дедлайна, который может запросить клиент (сек); по умолчанию – PARSE_DEADLINE
+PARSE_DEADLINE_MAX = float(os.environ.get("PARSE_DEADLINE_MAX", "300"))
+
+# Максимум изображений глифов в ответе (после склейки вариантов одной картинки)
+GLYPH_IMAGES_MAX = int(os.environ.get("GLYPH_IMAGES_MAX", "60"))
+
+# Минимальное число "сильных" glyph-картинок на основной странице, при котором specimen страницу не скрапим
+SPECIMEN_MIN_GLYPHS = int(os.environ.get("SPECIMEN_MIN_GLYPHS", "2"))
+
+# Кэш готовых ответов /parse и /parse_fiverr: время жизни (сек) и максимальное число записей
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX = int(os.environ.get("RESPONSE_CACHE_MAX", "256"))
+
+# Admission control: одновременных парсингов и мест в очереди на эндпоинт, максимум ожидания в очереди (сек)
+PARSE_MAX_INFLIGHT = int(os.environ.get("PARSE_MAX_INFLIGHT", "4"))
+PARSE_MAX_QUEUE = int(os.environ.get("PARSE_MAX_QUEUE", "8"))
+# Очередь из PARSE_MAX_QUEUE мест – это ceil(MAX_QUEUE / MAX_INFLIGHT) "раундов" парсинга,
+# поэтому PARSE_QUEUE_TIMEOUT не меньше 2 × PARSE_EXPECTED_LATENCY, иначе хвост очереди мёртв
+PARSE_QUEUE_TIMEOUT = float(os.environ.get("PARSE_QUEUE_TIMEOUT", "60"))
+# Оценка длительности парсинга, пока нет статистики (сек)
+PARSE_EXPECTED_LATENCY = float(os.environ.get("PARSE_EXPECTED_LATENCY", "30"))
+
+# brotli – необязательная зависимость, без неё отдаём только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ijson – потоковый разбор ответа Firecrawl; без него тело декодируется целиком через json
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # Создаём Flask-приложение и насильно выключаем debug на уровне конфигурации,
 # чтобы переменные окружения FLASK_DEBUG/FLASK_ENV не смогли вновь включить режим разработки
 app = Flask(__name__)
@@ -45,42 +102,80 @@ class FontWebParser:
         except Exception as e:
             print(f"Error initializing OpenAI client in FontWebParser: {str(e)}")
             self.openai_client = None
+
+        # Маршрутизация вызовов OpenAI по задачам (OPENAI_ROUTES), по умолчанию – этот клиент и MODEL
+        self.router = ModelRouter(self.openai_client, MODEL, OPENAI_BASE_URL, OPENAI_API_KEY)
+
+        # Счётчики specimen-стадии (доступны через /stats)
+        self.stats_lock = threading.Lock()
+        self.specimen_stats = {
+            "scraped": 0,   # specimen страница загружена
+            "skipped": 0,   # основной страницы хватило, второй скрап не делали
+            "failed": 0     # specimen не загрузилась, отдали результат основной страницы
+        }
+
+    def count_stat(self, key):
+        """Потокобезопасное увеличение счётчика specimen-стадии"""
+        with self.stats_lock:
+            self.specimen_stats[key] += 1
+
+    def get_stats(self):
+        """Снимок счётчиков парсера"""
+        with self.stats_lock:
+            return {"specimen": dict(self.specimen_stats)}
+
+    def count_strong_glyphs(self, images):
+        """Число картинок, которые почти наверняка являются глифами (allglyph, alphabet и т.п.)"""
+        strong_keywords = ['glyph', 'character', 'alphabet', 'specimen']
+        return sum(1 for img in images if any(k in img.lower() for k in strong_keywords))
+
+    def needs_specimen(self, main_preview, glyphs_main):
+        """Нужно ли догружать specimen страницу: нет hero-картинки или мало glyph-кандидатов"""
+        if not main_preview:
+            return True
+        return self.count_strong_glyphs(glyphs_main) < SPECIMEN_MIN_GLYPHS
     
-    def parse_font_from_url(self, font_url):
-        """Парсинг шрифта по URL"""
+    def parse_font_from_url(self, font_url, force_specimen=False, budget=None):
+        """Парсинг шрифта по URL в пределах бюджета времени запроса"""
+        budget = budget or RequestBudget()
         try:
             # Валидация URL
             if not self.is_valid_cf_url(font_url):
                 return {"error": "Некорректная ссылка на Creative Fabrica"}
             
-            # Формируем URL для specimen страницы
-            specimen_url = self.get_specimen_url(font_url)
-            
             # Парсим основную страницу
-            main_data = self.firecrawl_scrape(font_url)
+            main_data = self.firecrawl_scrape(font_url, budget)
             if not main_data:
                 return {"error": "Не удалось загрузить основную страницу"}
             
-            # Парсим specimen страницу
-            specimen_data = self.firecrawl_scrape(specimen_url)
-            if not specimen_data:
-                return {"error": "Не удалось загрузить specimen страницу"}
-            
             # Извлекаем данные
-            font_info = self.extract_font_name_description(main_data)
+            font_info = self.extract_font_name_description(main_data, budget)
             # Извлекаем главное превью изображения
             main_preview = self.extract_main_preview_image(main_data)
-            # Извлекаем изображения глифов с обеих страниц и объединяем
-            glyphs_specimen = self.extract_all_glyph_images(specimen_data)
             glyphs_main = self.extract_all_glyph_images(main_data)
 
+            # Specimen страницу скрапим только если основной не хватило или об этом попросили явно.
+            # Ошибка загрузки specimen не роняет парсинг – остаёмся с данными основной страницы.
+            glyphs_specimen = []
+            if force_specimen or self.needs_specimen(main_preview, glyphs_main):
+                specimen_data = self.firecrawl_scrape(self.get_specimen_url(font_url), budget, ['all_glyph_images'])
+                if specimen_data:
+                    self.count_stat("scraped")
+                    glyphs_specimen = self.extract_all_glyph_images(specimen_data)
+                else:
+                    self.count_stat("failed")
+                    print(f"Specimen page unavailable, using main page only: {font_url}")
+            else:
+                self.count_stat("skipped")
+
             combined_list = []
             if main_preview:
                 combined_list.append(main_preview)
             combined_list.extend(glyphs_specimen)
             combined_list.extend([img for img in glyphs_main if img not in combined_list])
 
-            all_glyph_images = combined_list  # без ограничения количества
+            # Размеры/форматы одной и той же картинки с обеих страниц схлопываем в один лучший вариант
+            all_glyph_images = dedupe_image_variants(combined_list)[:GLYPH_IMAGES_MAX]
             
             # Генерируем все блоки
             result = {
@@ -94,14 +189,18 @@ class FontWebParser:
             # Добавляем SEO и JSON контент
             result['pinterest_seo'] = self.generate_pinterest_seo(
                 result['font_name'], 
-                result['description']
+                result['description'],
+                budget
             )
             result['pinterest_json'] = self.generate_pinterest_json_format(
                 result['font_name'],
                 result['pinterest_seo']['pin_description'],
-                font_url
+                font_url,
+                budget
             )
-            result['image_prompt'] = self.generate_image_prompt(result['font_name'], result['description'], all_glyph_images)
+            result['image_prompt'] = self.generate_image_prompt(result['font_name'], result['description'], all_glyph_images, budget)
+            # Поля, для которых из-за дедлайна использован шаблонный fallback
+            result['degraded'] = budget.degraded
             
             return result
             
@@ -128,33 +227,77 @@ class FontWebParser:
         else:
             return f"{font_url}/ref/8035929/?campaign=aut"
     
-    def firecrawl_scrape(self, url):
-        """Скрапинг через Firecrawl"""
-        scrape_payload = {
-            "url": url,
-            "formats": ["html", "markdown"],
-            "waitFor": 6000,
-            "timeout": 45000
-        }
-        
+    @upstream_span('firecrawl.scrape')
+    def firecrawl_scrape(self, url, budget=None, fields=()):
+        """Скрапинг через Firecrawl (таймаут – не больше остатка бюджета запроса)"""
         try:
-            response = requests.post(
+            timeout = budget.stage_timeout(60, fields) if budget else 60
+            # Firecrawl должен уложиться в свой таймаут раньше, чем истечёт наш HTTP-таймаут
+            firecrawl_timeout = int(min(45000, max(1000, (timeout - 1) * 1000)))
+            scrape_payload = {
+                "url": url,
+                "formats": ["html", "markdown"],
+                "waitFor": min(6000, firecrawl_timeout // 2),
+                "timeout": firecrawl_timeout
+            }
+            with requests.post(
                 f"{FIRECRAWL_BASE_URL}/scrape",
                 headers=self.firecrawl_headers,
                 json=scrape_payload,
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('data', {})
-            else:
+                timeout=timeout,
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    return None
+                data = self.read_json_spooled(response, budget, fields)
+            # {"success": false} или пустой data – страница не загружена, а не пустая страница
+            if not (data.get('html') or data.get('markdown')):
+                print(f"Firecrawl returned no content for {url}")
                 return None
+            record_payload('firecrawl', url, data)
+            # Сырой payload сразу заменяем компактной выжимкой
+            return self.compact_scrape_data(data)
                 
+        except BudgetExceeded as e:
+            print(f"Firecrawl scrape skipped for {url}: {str(e)}")
+            return None
+        except requests.exceptions.Timeout as e:
+            if budget:
+                budget.degrade(fields)
+            print(f"Firecrawl scrape timeout for {url}: {str(e)}")
+            return None
         except Exception as e:
+            print(f"Firecrawl scrape error for {url}: {str(e)}")
             return None
+
+    def chat_completion(self, task, budget, fields, cap=OPENAI_STAGE_TIMEOUT, **kwargs):
+        """chat.completions.create через роутер задачи с таймаутом из остатка бюджета запроса.
+        При исчерпании бюджета или таймауте поля помечаются как degraded"""
+        return self.router.complete(task, budget, fields, cap, **kwargs)
+
+    def read_json_spooled(self, response, budget=None, fields=()):
+        """Читаем тело ответа через spool_body (лимиты размера и бюджета запроса)
+        и достаём из `data` только SCRAPE_FIELDS. С ijson поля разбираются потоково из файла,
+        и в памяти не оказываются одновременно всё тело, его строка и полное дерево объектов"""
+        with spool_body(response, budget, fields) as spool:
+            if ijson is None:
+                data = json.load(spool).get('data', {}) or {}
+                return {key: data[key] for key in SCRAPE_FIELDS if key in data}
+            return {key: value for key, value in ijson.kvitems(spool, 'data', use_float=True) if key in SCRAPE_FIELDS}
+
+    def compact_scrape_data(self, data):
+        """Оставляем от ответа Firecrawl только то, что читают экстракторы"""
+        html = data.get('html', '') or ''
+        markdown = data.get('markdown', '') or ''
+        fragments = re.findall(SLIM_HTML_PATTERN, html or markdown, flags=re.IGNORECASE)
+        return {
+            'html': '\n'.join(fragments),
+            'markdown': (markdown or html)[:FONT_CONTENT_LIMIT],
+            'images': list(data.get('images', []) or [])
+        }
     
-    def extract_font_name_description(self, main_data):
+    @upstream_span('openai.extract_font_name_description')
+    def extract_font_name_description(self, main_data, budget=None):
         """Извлечение названия и описания шрифта"""
         content = main_data.get('markdown', '') or main_data.get('html', '')
         
@@ -165,7 +308,7 @@ class FontWebParser:
   "description": "Полное описание шрифта и его особенностей"
 }}
 
-Контент: {content[:20000]}"""
+Контент: {content[:FONT_CONTENT_LIMIT]}"""
 
         if not self.openai_client:
             return {
@@ -174,8 +317,8 @@ class FontWebParser:
             }
 
         try:
-            response = self.openai_client.chat.completions.create(
-                model=MODEL,
+            response = self.chat_completion(
+                'name_description', budget, ['font_name', 'description'],
                 messages=[
                     {"role": "system", "content": "Извлекай точное название шрифта и его описание в JSON формате."},
                     {"role": "user", "content": prompt}
@@ -213,8 +356,8 @@ class FontWebParser:
                 if url_part.startswith('https://'):
                     found_images.append(url_part)
         
-        # Убираем дубликаты
-        found_images = list(set(found_images))
+        # Убираем дубликаты, сохраняя порядок появления на странице (set давал разный порядок между запусками)
+        found_images = list(dict.fromkeys(found_images))
         
         # Ищем изображения с глифами по ключевым словам
         glyph_keywords = ['glyph', 'allglyph', 'allglyphs', 'character', 'alphabet', 'specimen', 'font']
@@ -245,13 +388,14 @@ class FontWebParser:
         if not final_images and specimen_data.get('images'):
             final_images = specimen_data['images'][:20]
 
-        # Ограничиваем общее количество до 60, чтобы не перегружать фронт
-        if len(final_images) > 60:
-            final_images = final_images[:60]
+        # Варианты одной картинки (srcset-размеры, webp, query string) оставляем в одном экземпляре
+        final_images = dedupe_image_variants(final_images)
 
-        return final_images  # без ограничений количества
+        # Ограничиваем общее количество, чтобы не перегружать фронт
+        return final_images[:GLYPH_IMAGES_MAX]
     
-    def generate_pinterest_seo(self, font_name, description):
+    @upstream_span('openai.generate_pinterest_seo')
+    def generate_pinterest_seo(self, font_name, description, budget=None):
         """Генерация Pinterest SEO контента"""
         prompt = f"""**PINTEREST SEO OPTIMIZATION PROMPT**
 
@@ -292,8 +436,8 @@ Provide response in JSON format:
             }
 
         try:
-            response = self.openai_client.chat.completions.create(
-                model=MODEL,
+            response = self.chat_completion(
+                'seo', budget, 'pinterest_seo',
                 messages=[
                     {"role": "system", "content": "You are a Pinterest SEO expert. Create highly optimized Pinterest content in JSON format."},
                     {"role": "user", "content": prompt}
@@ -317,7 +461,8 @@ Provide response in JSON format:
                 "optimization_notes": "Basic SEO structure"
             }
     
-    def generate_pinterest_json_format(self, font_name, description, main_url):
+    @upstream_span('openai.generate_pinterest_json_format')
+    def generate_pinterest_json_format(self, font_name, description, main_url, budget=None):
         """Генерация блока 5 в формата JSON для Pinterest"""
         prompt = f"""**PINTEREST JSON FORMAT GENERATOR**
 
@@ -363,8 +508,8 @@ Provide response in JSON format:
             }
 
         try:
-            response = self.openai_client.chat.completions.create(
-                model=MODEL,
+            response = self.chat_completion(
+                'pinterest_json', budget, 'pinterest_json',
                 messages=[
                     {"role": "system", "content": "You are a Pinterest marketing expert. Generate Pinterest pin data in strict JSON format with exact field order including alt_text."},
                     {"role": "user", "content": prompt}
@@ -412,7 +557,8 @@ Provide response in JSON format:
                 "link": self.get_affiliate_url(main_url)
             }
     
-    def generate_image_prompt(self, font_name, description, glyph_images):
+    @upstream_span('openai.generate_image_prompt')
+    def generate_image_prompt(self, font_name, description, glyph_images, budget=None):
         """Генерация промпта для создания изображения с учетом стиля шрифта"""
         # Анализируем стиль шрифта
         font_style = self.analyze_font_style(font_name)
@@ -430,8 +576,8 @@ Provide response in JSON format:
             return base_prompt
 
         try:
-            response = self.openai_client.chat.completions.create(
-                model=MODEL,
+            response = self.chat_completion(
+                'image_prompt', budget, 'image_prompt',
                 messages=[
                     {"role": "system", "content": "You create highly detailed, vivid image generation prompts."},
                     {"role": "user", "content": prompt}
@@ -567,35 +713,358 @@ parser = FontWebParser()
 # Экземпляр парсера Fiverr
 fiverr_parser_instance = FiverrParser()
 
+class AdmissionController:
+    """Ограничение одновременных парсингов и очереди ожидания для одного эндпоинта.
+    Сверх лимитов запрос сразу получает 429 с Retry-After, оценённым по недавним длительностям парсинга"""
+    def __init__(self, name, max_inflight=PARSE_MAX_INFLIGHT, max_queue=PARSE_MAX_QUEUE,
+                 queue_timeout=PARSE_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.running = []         # время старта парсингов, которые выполняются сейчас
+        self.avg_latency = None   # скользящее среднее (EWMA) длительности успешного парсинга, сек
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0}
+
+    def estimated_wait(self, position):
+        """Сколько ждать месту `position` в очереди: слоты освобождаются, когда текущие парсинги
+        доработают до средней длительности, дальше каждый слот – через среднюю длительность"""
+        latency = self.avg_latency or PARSE_EXPECTED_LATENCY
+        now = time.monotonic()
+        # Парсинг, идущий дольше среднего, считаем почти завершённым
+        slots = [max(latency - (now - started), 0.0) for started in self.running]
+        slots += [0.0] * (self.max_inflight - len(slots))
+        heapq.heapify(slots)
+        for _ in range(position):
+            heapq.heappush(slots, heapq.heappop(slots) + latency)
+        return slots[0]
+
+    def admit(self, budget=None):
+        """Занять слот. Возвращает время старта или None, если запрос отклонён (shed)"""
+        with self.cond:
+            if self.in_flight < self.max_inflight and self.queue_depth == 0:
+                return self._start()
+            # Очередь полна или дождаться слота не успеем до дедлайна запроса – отказываем сразу
+            wait_limit = min(self.queue_timeout, budget.remaining()) if budget else self.queue_timeout
+            if self.queue_depth >= self.max_queue or self.estimated_wait(self.queue_depth) > wait_limit:
+                self.counters["shed"] += 1
+                return None
+            self.queue_depth += 1
+            self.counters["queued"] += 1
+            give_up_at = time.monotonic() + wait_limit
+            try:
+                while self.in_flight >= self.max_inflight:
+                    left = give_up_at - time.monotonic()
+                    if left <= 0:
+                        self.counters["shed"] += 1
+                        return None
+                    self.cond.wait(left)
+            finally:
+                self.queue_depth -= 1
+            return self._start()
+
+    def _start(self):
+        self.in_flight += 1
+        self.counters["admitted"] += 1
+        started = time.monotonic()
+        self.running.append(started)
+        return started
+
+    def release(self, started, ok=True):
+        """Освободить слот. Длительность учитываем только у успешных парсингов: мгновенные
+        ошибки валидации иначе занижают среднее и Retry-After"""
+        with self.cond:
+            self.in_flight -= 1
+            self.running.remove(started)
+            if ok:
+                latency = time.monotonic() - started
+                self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+            self.cond.notify()
+
+    def retry_after(self):
+        """Retry-After (сек): когда освободится место для нового запроса"""
+        with self.cond:
+            return max(1, math.ceil(self.estimated_wait(self.queue_depth)))
+
+    def get_stats(self):
+        with self.cond:
+            return dict(self.counters,
+                        in_flight=self.in_flight,
+                        queue_depth=self.queue_depth,
+                        max_inflight=self.max_inflight,
+                        max_queue=self.max_queue,
+                        avg_latency_ms=round(self.avg_latency * 1000) if self.avg_latency is not None else None)
+
+admission = {
+    "parse": AdmissionController("parse"),
+    "parse_fiverr": AdmissionController("parse_fiverr")
+}
+
+def shed_response(controller):
+    """429 с Retry-After для отклонённого запроса"""
+    retry_after = controller.retry_after()
+    response = jsonify({"error": "Сервер перегружен, повторите запрос позже", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def run_admitted(endpoint, func, url, budget, **kwargs):
+    """Запуск парсера через admission control эндпоинта.
+    Возвращает (результат, id профиля) или None, если запрос отклонён"""
+    controller = admission[endpoint]
+    started = controller.admit(budget)
+    if started is None:
+        return None
+    ok = False
+    try:
+        outcome = run_parser(func, url, budget=budget, **kwargs)
+        ok = not outcome[0].get("error")
+        return outcome
+    finally:
+        controller.release(started, ok)
+
+# Кэш ответов: ключ -> {"body", "etag", "last_modified", "created", "encoded", "no_store"}
+response_cache = {}
+response_cache_lock = threading.Lock()
+
+def cache_bypassed():
+    """Cache-Control: no-cache и профилируемые запросы идут мимо кэша и single-flight"""
+    return bool(request.cache_control.no_cache or profiling_requested())
+
+def get_cached_response(key):
+    """Достаём свежую запись из кэша ответов (или None)"""
+    if cache_bypassed():
+        return None
+    with response_cache_lock:
+        entry = response_cache.get(key)
+        if entry and time.time() - entry["created"] < RESPONSE_CACHE_TTL:
+            return entry
+        response_cache.pop(key, None)
+        return None
+
+def store_cached_response(key, result):
+    """Сериализуем результат, считаем ETag и кладём в кэш (ошибки не кэшируем)"""
+    body = app.json.dumps(result, separators=(',', ':')).encode('utf-8')
+    now = time.time()
+    entry = {
+        "body": body,
+        "etag": hashlib.sha256(body).hexdigest()[:32],
+        "last_modified": now,
+        "created": now,
+        "encoded": {},
+        "no_store": not_cacheable(result)
+    }
+    if entry["no_store"]:
+        return entry
+    with response_cache_lock:
+        if len(response_cache) >= RESPONSE_CACHE_MAX:
+            # Выкидываем самую старую запись
+            oldest = min(response_cache, key=lambda k: response_cache[k]["created"])
+            response_cache.pop(oldest, None)
+        response_cache[key] = entry
+    return entry
+
+def encode_body(entry, encoding):
+    """Сжатое тело ответа (результат сжатия запоминаем в записи кэша)"""
+    if encoding not in entry["encoded"]:
+        if encoding == 'br':
+            entry["encoded"][encoding] = brotli.compress(entry["body"])
+        else:
+            entry["encoded"][encoding] = gzip.compress(entry["body"], compresslevel=6)
+    return entry["encoded"][encoding]
+
+def build_cached_response(entry, no_store=False):
+    """JSON-ответ с ETag, Last-Modified, Cache-Control, 304 по If-None-Match и gzip/brotli"""
+    offers = ['br', 'gzip'] if brotli else ['gzip']
+    encoding = request.accept_encodings.best_match(offers)
+    body = encode_body(entry, encoding) if encoding else entry["body"]
+    # Сжатое и несжатое представления – разные байты, поэтому у них разные сильные ETag
+    etag = f'{entry["etag"]}-{encoding}' if encoding else entry["etag"]
+
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if no_store:
+        response.headers['Cache-Control'] = 'no-store'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = formatdate(entry["last_modified"], usegmt=True)
+    max_age = max(0, int(RESPONSE_CACHE_TTL - (time.time() - entry["created"])))
+    response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        response.set_data(b'')
+        return response
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Парсинги, которые выполняются сейчас: ключ кэша -> {"event", "outcome", "error"}
+inflight = {}
+inflight_lock = threading.Lock()
+
+def single_flight(key, compute, budget):
+    """Одинаковые одновременные запросы ждут результат первого вместо повторного парсинга.
+    compute() возвращает (запись кэша, id профиля) или None, если запрос отклонён;
+    ожидающие получают ту же запись (без id профиля) или None. Ждут не дольше своего дедлайна
+    (иначе BudgetExceeded), а исключение первого запроса получают как RuntimeError"""
+    with inflight_lock:
+        call = inflight.get(key)
+        leader = call is None
+        if leader:
+            call = inflight[key] = {"event": threading.Event(), "outcome": None, "error": None}
+    if not leader:
+        if not call["event"].wait(max(0.0, budget.remaining())):
+            raise BudgetExceeded("deadline passed while waiting for the same request")
+        if call["error"] is not None:
+            raise RuntimeError(f"Coalesced request failed: {call['error']}")
+        return (call["outcome"][0], None) if call["outcome"] else None
+    try:
+        call["outcome"] = compute()
+        return call["outcome"]
+    except Exception as e:
+        call["error"] = e
+        raise
+    finally:
+        with inflight_lock:
+            inflight.pop(key, None)
+        call["event"].set()
+
+def serve_parse(endpoint, cache_key, func, url, budget, **kwargs):
+    """Ответ парсинга: кэш, затем single-flight по ключу кэша, затем admission control и парсер"""
+    entry = get_cached_response(cache_key)
+    if entry:
+        return build_cached_response(entry)
+
+    def compute():
+        outcome = run_admitted(endpoint, func, url, budget, **kwargs)
+        if outcome is None:
+            return None
+        result, profile_id = outcome
+        return store_cached_response(cache_key, result), profile_id
+
+    try:
+        outcome = compute() if cache_bypassed() else single_flight(cache_key, compute, budget)
+    except BudgetExceeded:
+        return jsonify({"error": "Истёк дедлайн запроса, повторите запрос позже"}), 504
+    if outcome is None:
+        return shed_response(admission[endpoint])
+    entry, profile_id = outcome
+    return with_profile_header(build_cached_response(entry, no_store=entry["no_store"]), profile_id)
+
+def profiling_requested():
+    """Профилирование включено, только если задан PROFILE_TOKEN и запрос передал тот же токен
+    в заголовке X-Profile (не в query string, чтобы токен не попадал в access-логи)"""
+    if not PROFILE_TOKEN:
+        return False
+    token = request.headers.get('X-Profile', '')
+    # compare_digest с str принимает только ASCII – сравниваем байты
+    return hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+def run_parser(func, url, **kwargs):
+    """Запуск парсера; по флагу профилирования – под семплирующим профайлером.
+    Возвращает (результат, id профиля или None)"""
+    if not profiling_requested():
+        return func(url, **kwargs), None
+    with RequestProfiler(f"{request.path} {url}") as profiler:
+        result = func(url, **kwargs)
+    return result, save_profile(profiler)
+
+def with_profile_header(response, profile_id):
+    if profile_id:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+def not_cacheable(result):
+    """Ошибки и результаты с degraded-полями (упёрлись в дедлайн) не кэшируем"""
+    return bool(result.get("error") or result.get("degraded"))
+
+def request_budget(data):
+    """Бюджет запроса: deadline (сек) из тела/query или заголовка X-Deadline, иначе PARSE_DEADLINE"""
+    raw = data.get('deadline') or request.headers.get('X-Deadline')
+    try:
+        seconds = float(raw) if raw else PARSE_DEADLINE
+    except (TypeError, ValueError):
+        seconds = PARSE_DEADLINE
+    # nan/inf проходят через min/max и оставляют запрос без дедлайна
+    if not math.isfinite(seconds):
+        seconds = PARSE_DEADLINE
+    return RequestBudget(min(max(seconds, 1.0), PARSE_DEADLINE_MAX))
+
+def request_params():
+    """Параметры запроса: JSON-тело для POST, query string для GET"""
+    if request.method == 'GET':
+        return request.args
+    return request.get_json(silent=True) or {}
+
 @app.route('/')
 def index():
     """Главная страница"""
     return render_template('index.html')
 
-@app.route('/parse', methods=['POST'])
+@app.route('/parse', methods=['GET', 'POST'])
 def parse_font():
     """API для парсинга шрифта"""
-    data = request.get_json()
+    data = request_params()
     font_url = data.get('font_url', '').strip()
     
     if not font_url:
         return jsonify({"error": "Введите ссылку на шрифт"})
     
-    result = parser.parse_font_from_url(font_url)
-    return jsonify(result)
+    force_specimen = str(data.get('force_specimen', '')).lower() in ('1', 'true', 'yes')
+    # Бюджет создаём до очереди: ожидание слота тоже расходует дедлайн запроса
+    return serve_parse('parse', ('parse', font_url, force_specimen), parser.parse_font_from_url,
+                       font_url, request_budget(data), force_specimen=force_specimen)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Счётчики работы парсеров"""
+    return jsonify({
+        "font": parser.get_stats(),
+        "routes": route_stats(),
+        "admission": {name: controller.get_stats() for name, controller in admission.items()}
+    })
 
 # Новый эндпоинт для парсинга Fiverr Gig
-@app.route('/parse_fiverr', methods=['POST'])
+@app.route('/parse_fiverr', methods=['GET', 'POST'])
 def parse_fiverr():
     """API для парсинга Fiverr Gig"""
-    data = request.get_json()
+    data = request_params()
     gig_url = data.get('gig_url', '').strip()
 
     if not gig_url:
         return jsonify({"error": "Введите ссылку на Fiverr gig"})
 
-    result = fiverr_parser_instance.parse(gig_url)
-    return jsonify(result)
+    return serve_parse('parse_fiverr', ('parse_fiverr', gig_url), fiverr_parser_instance.parse,
+                       gig_url, request_budget(data))
+
+def admin_allowed():
+    """Доступ к /admin/* – только с тем же PROFILE_TOKEN в заголовке X-Profile"""
+    return profiling_requested()
+
+@app.route('/admin/profiles', methods=['GET'])
+def admin_profiles():
+    """Список сохранённых профилей запросов (спаны upstream-вызовов, wall/CPU время)"""
+    if not admin_allowed():
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"profiles": list_profiles()})
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def admin_profile(profile_id):
+    """Профиль в формате speedscope JSON – открывается на https://www.speedscope.app"""
+    if not admin_allowed():
+        return jsonify({"error": "Not found"}), 404
+    trace = get_profile(profile_id)
+    if trace is None:
+        return jsonify({"error": "Profile not found"}), 404
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = f'attachment; filename={profile_id}.speedscope.json'
+    return response
 
 if __name__ == '__main__':
     # Получаем порт из переменной окружения или используем 5000 по умолчанию
@@ -0,0 +1,237 @@
+"""Массовый парсинг списка ссылок Creative Fabrica и Fiverr.
+
+Примеры:
+    python bulk_parse.py urls.txt -o results.jsonl --workers 8
+    cat urls.txt | python bulk_parse.py - -o results.csv --mode process --workers 4
+
+Ссылки на creativefabrica.com идут в FontWebParser, на fiverr.com – в FiverrParser.
+Результаты дописываются в выходной файл по мере готовности (JSONL или CSV – по расширению
+или --format). Обработанные ссылки отмечаются в checkpoint-файле (по умолчанию
+<output>.checkpoint), поэтому прерванный прогон можно запустить той же командой –
+готовые ссылки будут пропущены.
+
+У каждой строки есть status: ok, error (--retry-errors обработает ссылку ещё раз) или invalid
+(неподдерживаемый домен или некорректная ссылка – повтор не поможет, не повторяется).
+Одна ссылка может встретиться в выходном файле несколько раз: после --retry-errors или при
+падении между записью результата и checkpoint. Актуальна последняя строка для url.
+
+Ctrl-C: очередь отменяется, начатые ссылки дописываются; повторный Ctrl-C – немедленный выход.
+"""
+import argparse, csv, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+CSV_FIELDS = ['url', 'type', 'status', 'title', 'description', 'affiliate_url', 'images', 'degraded', 'error', 'json']
+
+# Парсеры создаются лениво – по одному набору на процесс
+_parsers = None
+
+
+def get_parsers():
+    global _parsers
+    if _parsers is None:
+        from app import FontWebParser
+        from fiverr_parser.fiverr_parser import FiverrParser
+        _parsers = {'font': FontWebParser(), 'fiverr': FiverrParser()}
+    return _parsers
+
+
+def url_type(url):
+    """Тип ссылки по домену: font / fiverr / None"""
+    host = urlparse(url).netloc.lower()
+    if host.endswith('creativefabrica.com'):
+        return 'font'
+    if host.endswith('fiverr.com'):
+        return 'fiverr'
+    return None
+
+
+def parse_one(url, deadline=None):
+    """Парсинг одной ссылки (выполняется в потоке или процессе-воркере).
+    Возвращает (url, тип, результат, статус ok / error / invalid)"""
+    from fiverr_parser.fiverr_parser import RequestBudget
+    kind = url_type(url)
+    if kind is None:
+        return url, kind, {'error': 'Unsupported domain'}, 'invalid'
+    budget = RequestBudget(deadline)
+    try:
+        parsers = get_parsers()
+        if kind == 'font':
+            if not parsers['font'].is_valid_cf_url(url):
+                return url, kind, {'error': 'Invalid Creative Fabrica URL'}, 'invalid'
+            result = parsers['font'].parse_font_from_url(url, budget=budget)
+        else:
+            if not parsers['fiverr'].is_valid(url):
+                return url, kind, {'error': 'Invalid Fiverr URL'}, 'invalid'
+            result = parsers['fiverr'].parse(url, budget=budget)
+    except Exception as e:
+        result = {'error': f'{type(e).__name__}: {str(e)}'}
+    return url, kind, result, 'error' if result.get('error') else 'ok'
+
+
+def read_urls(source):
+    """Ссылки из файла или stdin ('-'): без пустых строк, комментариев и дублей"""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        urls = [line.strip() for line in stream]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return list(dict.fromkeys(u for u in urls if u and not u.startswith('#')))
+
+
+def read_checkpoint(path, retry_errors):
+    """Множество ссылок, которые уже не нужно обрабатывать (invalid не повторяем и с --retry-errors)"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            status, _, url = line.rstrip('\n').partition('\t')
+            if url and (status != 'error' or not retry_errors):
+                done.add(url)
+    return done
+
+
+class ResultWriter:
+    """Дописывает результаты в JSONL/CSV и отмечает ссылки в checkpoint"""
+    def __init__(self, output, fmt, checkpoint):
+        self.fmt = fmt
+        new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+        self.out = open(output, 'a', encoding='utf-8', newline='')
+        self.checkpoint = open(checkpoint, 'a', encoding='utf-8')
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(self.out, fieldnames=CSV_FIELDS)
+            if new_file:
+                self.csv.writeheader()
+
+    def write(self, url, kind, result, status):
+        if self.fmt == 'csv':
+            self.csv.writerow({
+                'url': url,
+                'type': kind or '',
+                'status': status,
+                'title': result.get('font_name') or result.get('gig_title') or '',
+                'description': result.get('description', ''),
+                'affiliate_url': result.get('affiliate_url', ''),
+                'images': ' '.join(result.get('all_glyph_images') or result.get('images') or []),
+                'degraded': ','.join(result.get('degraded') or []),
+                'error': result.get('error', ''),
+                'json': json.dumps(result, ensure_ascii=False),
+            })
+        else:
+            self.out.write(json.dumps({'url': url, 'type': kind, 'status': status, 'result': result}, ensure_ascii=False) + '\n')
+        self.out.flush()
+        # checkpoint пишем только после того, как результат попал в файл
+        self.checkpoint.write(f"{status}\t{url}\n")
+        self.checkpoint.flush()
+
+    def close(self):
+        self.out.close()
+        self.checkpoint.close()
+
+
+def format_eta(seconds):
+    """ETA как '1d 16:00:00' – time.strftime по gmtime сбрасывается каждые 24 часа"""
+    days, rest = divmod(int(seconds), 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes, secs = divmod(rest, 60)
+    clock = f'{hours:02d}:{minutes:02d}:{secs:02d}'
+    return f'{days}d {clock}' if days else clock
+
+
+class Progress:
+    """Строка прогресса: выполнено, ошибки, скорость и ETA"""
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.errors = 0
+        self.started = time.monotonic()
+
+    def update(self, failed):
+        self.done += 1
+        self.errors += int(failed)
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0
+        sys.stderr.write(f"\r[{self.done}/{self.total}] errors={self.errors} "
+                         f"{rate * 60:.1f} url/min ETA {format_eta(eta)}   ")
+        sys.stderr.flush()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Bulk parse Creative Fabrica font and Fiverr gig URLs.')
+    ap.add_argument('input', help="file with one URL per line, or '-' for stdin")
+    ap.add_argument('-o', '--output', required=True, help='results file (.jsonl or .csv)')
+    ap.add_argument('--format', choices=['jsonl', 'csv'], help='output format (default: by extension)')
+    ap.add_argument('--workers', type=int, default=4, help='parallel workers (default: 4)')
+    ap.add_argument('--mode', choices=['thread', 'process'], default='thread', help='worker type (default: thread)')
+    ap.add_argument('--checkpoint', help='checkpoint file (default: <output>.checkpoint)')
+    ap.add_argument('--retry-errors', action='store_true',
+                    help='re-run URLs that finished with an error (not invalid/unsupported ones)')
+    ap.add_argument('--deadline', type=float, help='per-URL deadline in seconds (default: PARSE_DEADLINE)')
+    args = ap.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'jsonl')
+    checkpoint = args.checkpoint or f'{args.output}.checkpoint'
+
+    urls = read_urls(args.input)
+    done = read_checkpoint(checkpoint, args.retry_errors)
+    pending = [u for u in urls if u not in done]
+    print(f'{len(urls)} URL(s), {len(urls) - len(pending)} already done, {len(pending)} to parse', file=sys.stderr)
+    if not pending:
+        return 0
+
+    writer = ResultWriter(args.output, fmt, checkpoint)
+    progress = Progress(len(pending))
+    executor_cls = ProcessPoolExecutor if args.mode == 'process' else ThreadPoolExecutor
+    queue = iter(pending)
+    in_flight = set()
+    executor = executor_cls(max_workers=args.workers)
+
+    def record(future):
+        url, kind, result, status = future.result()
+        writer.write(url, kind, result, status)
+        progress.update(bool(result.get('error')))
+
+    try:
+        # держим в работе не больше 2×workers задач, чтобы не плодить тысячи futures
+        for url in queue:
+            in_flight.add(executor.submit(parse_one, url, args.deadline))
+            if len(in_flight) >= args.workers * 2:
+                break
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record(future)
+                next_url = next(queue, None)
+                if next_url is not None:
+                    in_flight.add(executor.submit(parse_one, next_url, args.deadline))
+    except KeyboardInterrupt:
+        # очередь отменяем, а уже начатые ссылки дописываем – иначе выход всё равно ждал бы потоки-воркеры
+        running = [f for f in in_flight if not f.cancel()]
+        print(f'\nInterrupted – finishing {len(running)} URL(s) already in progress, Ctrl-C again to stop now.',
+              file=sys.stderr)
+        try:
+            for future in as_completed(running):
+                try:
+                    record(future)
+                except Exception:
+                    pass    # воркер прерван вместе с нами (--mode process) – ссылка не попала в checkpoint
+        except KeyboardInterrupt:
+            writer.close()
+            print('\nStopped – run the same command again to resume.', file=sys.stderr)
+            # os._exit: не ждать потоки-воркеры при выходе интерпретатора, их ссылки будут обработаны заново
+            os._exit(130)
+        print('\nRun the same command again to resume.', file=sys.stderr)
+        return 130
+    finally:
+        # незавершённые ссылки не попали в checkpoint и будут обработаны при следующем запуске
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    print(f'\nDone: {progress.done} parsed, {progress.errors} error(s) -> {args.output}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
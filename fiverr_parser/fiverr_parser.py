@@ -1,4 +1,4 @@
-import json, os, re, sys, requests
+import json, os, re, sys, tempfile, time, requests
 from urllib.parse import urlparse, quote
 from openai import OpenAI
 from difflib import SequenceMatcher
@@ -13,8 +13,98 @@ MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
 AFFILIATE_BTA = os.getenv('FIVERR_BTA', '1048834')  # ваш ID
 AFFILIATE_BRAND = os.getenv('FIVERR_BRAND', 'fp')   # fp = Fiverr Pro, fiverrmarketplace = обычный
 
+try:
+    from fiverr_parser.model_router import ModelRouter
+    from fiverr_parser.image_variants import dedupe_image_variants
+except ImportError:
+    # standalone run from fiverr_parser/
+    from model_router import ModelRouter
+    from image_variants import dedupe_image_variants
+
+# optional streaming JSON parser: only the first Apify dataset item is built
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from profiling.corpus import record_payload
+    from profiling.request_profiler import span, upstream_span
+except ImportError:
+    # standalone run from fiverr_parser/ – corpus recording and request profiling are unavailable
+    import contextlib
+    record_payload = None
+    span = lambda name: contextlib.nullcontext()
+    upstream_span = lambda name: (lambda func: func)
+
 APIFY_ACT_ID = os.getenv('APIFY_ACT_ID', 'L6I0baErLZR5rW2lN')  # Fiverr actor
 
+# Response size limits: bodies up to SPOOL stay in memory, larger ones are spilled to a temp file
+SCRAPE_MAX_BYTES = int(os.getenv('SCRAPE_MAX_BYTES', str(20 * 1024 * 1024)))
+SCRAPE_SPOOL_BYTES = int(os.getenv('SCRAPE_SPOOL_BYTES', str(1024 * 1024)))
+
+# End-to-end parse budget (seconds) and per-stage caps
+PARSE_DEADLINE = float(os.getenv('PARSE_DEADLINE', '90'))
+MIN_STAGE_SECONDS = float(os.getenv('MIN_STAGE_SECONDS', '1'))
+OPENAI_STAGE_TIMEOUT = float(os.getenv('OPENAI_STAGE_TIMEOUT', '60'))
+
+# Result fields that come from the scraped page itself
+PAGE_FIELDS = ['gig_title', 'description', 'about', 'seller', 'packages', 'images']
+
+
+class BudgetExceeded(Exception):
+    """A stage was about to start with (almost) no request budget left."""
+
+
+class RequestBudget:
+    """Deadline shared by every scrape and completion stage of one parse.
+
+    Each stage asks for stage_timeout(cap, fields): the smaller of its own cap and the
+    remaining budget. When the budget is spent (or a stage times out) the stage's fields
+    are recorded in `degraded` and the caller falls back to its template output.
+    """
+    def __init__(self, seconds=None):
+        self.seconds = PARSE_DEADLINE if seconds is None else float(seconds)
+        self.expires_at = time.monotonic() + self.seconds
+        self.degraded = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def stage_timeout(self, cap:float, fields) -> float:
+        left = self.remaining()
+        if left < MIN_STAGE_SECONDS:
+            self.degrade(fields)
+            raise BudgetExceeded(f'{left:.1f}s of {self.seconds:.0f}s budget left')
+        return min(cap, left)
+
+    def degrade(self, fields):
+        for field in ([fields] if isinstance(fields, str) else fields):
+            if field not in self.degraded:
+                self.degraded.append(field)
+
+
+def spool_body(response, budget:RequestBudget=None, fields=()):
+    """Read a streamed response body in chunks into a spooled temp file (in memory up to
+    SCRAPE_SPOOL_BYTES, on disk beyond), enforcing SCRAPE_MAX_BYTES and the request budget:
+    the requests timeout is per socket read, so a body that trickles in would never hit it.
+    `fields` are marked degraded when the budget runs out. Shared with app.FontWebParser."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SCRAPE_SPOOL_BYTES)
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > SCRAPE_MAX_BYTES:
+            spool.close()
+            raise ValueError(f'Response larger than {SCRAPE_MAX_BYTES} bytes')
+        if budget and budget.remaining() <= 0:
+            spool.close()
+            budget.degrade(fields)
+            raise BudgetExceeded(f'budget spent after {size} bytes')
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
 class FiverrParser:
     def __init__(self):
         self.firecrawl_headers = {
@@ -42,45 +132,89 @@ class FiverrParser:
             print(f"Error initializing OpenAI client in FiverrParser: {str(e)}")
             self.openai = None
 
+        # per-task model/endpoint routing (OPENAI_ROUTES), defaults to self.openai + MODEL
+        self.router = ModelRouter(self.openai, MODEL, OPENAI_BASE_URL, OPENAI_API_KEY)
+
     def is_valid(self, url:str):
         p = urlparse(url)
         return p.netloc.endswith('fiverr.com') and '/gig/' not in p.path    # gig URLs are /username/title
 
-    def apify_fetch(self, url:str):
+    @upstream_span('apify.fetch')
+    def apify_fetch(self, url:str, budget:RequestBudget=None):
         """Scrape Fiverr gig HTML via Apify actor run-sync-dataset-items."""
-        # Документация: https://docs.apify.com/api/v2#/reference/actors/run-actor-and-get-dataset-items
-        endpoint = (
-            f"https://api.apify.com/v2/acts/{APIFY_ACT_ID}/run-sync-dataset-items"
-            f"?token={APIFY_TOKEN}&format=json&clean=true&simplified=1"
-        )
+        budget = budget or RequestBudget()
         payload = {"startUrls": [{"url": url}]}
         try:
-            r = requests.post(endpoint, json=payload, timeout=90)
-            if r.status_code == 200:
-                items = r.json()
-                if isinstance(items, list) and items:
-                    return {"html": items[0].get("html",""), "markdown": items[0].get("markdown","")}
+            timeout = budget.stage_timeout(90, PAGE_FIELDS)
+            # Документация: https://docs.apify.com/api/v2#/reference/actors/run-actor-and-get-dataset-items
+            endpoint = (
+                f"https://api.apify.com/v2/acts/{APIFY_ACT_ID}/run-sync-dataset-items"
+                f"?token={APIFY_TOKEN}&format=json&clean=true&simplified=1&timeout={int(timeout)}"
+            )
+            with requests.post(endpoint, json=payload, timeout=timeout, stream=True) as r:
+                if r.status_code == 200:
+                    with spool_body(r, budget, PAGE_FIELDS) as spool:
+                        item = self.first_item(spool)
+                    if isinstance(item, dict):
+                        if record_payload:
+                            record_payload('apify', url, item)
+                        return {"html": self.slim_html(item.get("html","") or ""), "markdown": item.get("markdown","") or ""}
+        except BudgetExceeded:
+            return {}
         except Exception:
             pass
         # Fallback – попробовать обычный GET (может не пройти Cloudflare, но попробуем)
         try:
             headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-            resp = requests.get(url, headers=headers, timeout=20)
-            if resp.status_code == 200:
-                return {"html": resp.text, "markdown": ""}
+            timeout = budget.stage_timeout(20, PAGE_FIELDS)
+            with requests.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+                if resp.status_code == 200:
+                    with spool_body(resp, budget, PAGE_FIELDS) as spool:
+                        html = spool.read().decode(resp.encoding or 'utf-8', errors='replace')
+                    if record_payload:
+                        record_payload('fiverr_get', url, {"html": html, "markdown": ""})
+                    return {"html": self.slim_html(html), "markdown": ""}
+        except requests.exceptions.Timeout:
+            budget.degrade(PAGE_FIELDS)
         except Exception:
             pass
         return {}
 
-    def parse(self, url:str):
+    def chat(self, task:str, budget:RequestBudget, fields, cap:float=OPENAI_STAGE_TIMEOUT, **kwargs):
+        """chat.completions.create routed by task and bounded by the remaining request budget.
+        Fields are marked degraded when the budget is spent or the call times out."""
+        return self.router.complete(task, budget, fields, cap, **kwargs)
+
+    def first_item(self, spool):
+        """First element of a JSON array body (None if empty); with ijson the rest is never decoded."""
+        if ijson is None:
+            items = json.load(spool)
+            return items[0] if isinstance(items, list) and items else None
+        return next(ijson.items(spool, 'item', use_float=True), None)
+
+    def slim_html(self, html:str) -> str:
+        """Drop page regions no extractor reads (styles, svg, comments, script bodies).
+        Script blocks are replaced in place by the cloudinary image URLs and package
+        fragments they contain, so the order seen by the regexes in parse() is preserved."""
+        html = re.sub(r'<style[^>]*>.*?</style>|<svg[^>]*>.*?</svg>|<!--.*?-->', '', html, flags=re.S|re.I)
+
+        def _keep_script_data(m):
+            body = m.group(1)
+            keep = re.findall(r'https://fiverr-res\.cloudinary\.com/[^"\'\s]+\.(?:jpg|png)', body)
+            keep += re.findall(r'"price":\d+,"packageName":"(?:Basic|Standard|Premium)"', body)
+            return ' '.join(f'"{k}"' if k.startswith('https://') else k for k in keep)
+
+        return re.sub(r'<script[^>]*>(.*?)</script>', _keep_script_data, html, flags=re.S|re.I)
+
+    def parse(self, url:str, budget:RequestBudget=None):
         if not self.is_valid(url):
             return {'error':'Invalid Fiverr URL'}
-        data = self.apify_fetch(url)
+        budget = budget or RequestBudget()
+        data = self.apify_fetch(url, budget)
         html = data.get('html','')
         md = data.get('markdown','')
 
-        title_match = re.search(r'<h1[^>]*>(.*?)</h1>', html, re.S)
-        title = re.sub('<[^>]+>','', title_match.group(1)).strip() if title_match else ''
+        title = self.extract_title(html)
 
         # если основные поля не найдены регулярками – используем OpenAI для структурного парсинга
         if not title:
@@ -107,14 +241,15 @@ class FiverrParser:
 }}
 
 Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
-                    ai_resp = self.openai.chat.completions.create(model=MODEL,messages=[{"role":"user","content":prompt}],response_format={"type":"json_object"},temperature=0)
+                    with span('openai.fiverr_structured_extract'):
+                        ai_resp = self.chat('structured_extract', budget, PAGE_FIELDS, messages=[{"role":"user","content":prompt}],response_format={"type":"json_object"},temperature=0)
                     parsed = json.loads(ai_resp.choices[0].message.content)
                     title = parsed.get('gig_title','')
                     desc = parsed.get('description','')
                     seller = parsed.get('seller_username','')
                     rating_val = parsed.get('rating')
                     reviews = parsed.get('reviews')
-                    images = parsed.get('images',[])
+                    images = dedupe_image_variants(parsed.get('images',[]))
                     packages_json = parsed.get('package_prices',[])
                 except Exception:
                     title = title or 'Gig Title'
@@ -125,19 +260,13 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
                     images = []
                     packages_json = []
         else:
-            desc_match = re.search(r'<meta[^>]+name="description"[^>]+content="([^"]+)"', html)
-            desc = desc_match.group(1) if desc_match else ''
-            seller_match = re.search(r'@([A-Za-z0-9_]+)</a>', html)
-            seller = seller_match.group(1) if seller_match else 'seller'
-            rating = re.search(r'(\d\.\d)\s*\(<span[^>]*>(\d+,?\d*)', html)
-            rating_val = float(rating.group(1)) if rating else None
-            reviews = int(rating.group(2).replace(',','')) if rating else None
-            images = re.findall(r'https://fiverr-res\.cloudinary\.com/[^"\']+\.(?:jpg|png)', html)
-            images = list(dict.fromkeys(images))
-            images = [img for img in images if not re.search(r'favicon|pdf_thumb|profile_small', img, re.I)]
-            images = list(dict.fromkeys(images))[:15]
-            packages = re.findall(r'"price":(\d+),"packageName":"(Basic|Standard|Premium)"', html)
-            packages_json = [{"name":p[1],"price":f"${p[0]}"} for p in packages]
+            fields = self.extract_gig_fields(html)
+            desc = fields['description']
+            seller = fields['seller']
+            rating_val = fields['rating']
+            reviews = fields['reviews']
+            images = fields['images']
+            packages_json = fields['packages']
 
         about_text = self.extract_about_section(html, md)
 
@@ -152,16 +281,42 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
         }
 
         # detect primary keyword from gig title (1-3 words)
-        primary_kw = self.extract_primary_keyword(title)
+        primary_kw = self.extract_primary_keyword(title, budget)
 
         # AI enrich prompt using whatever title/desc we obtained
-        result['sora_prompt'] = self.generate_prompt(title or 'Gig', desc or '', images[:3])
+        result['sora_prompt'] = self.generate_prompt(title or 'Gig', desc or '', images[:3], budget)
 
         # Pinterest SEO generate (dynamic keyword)
-        result['pinterest_seo'] = self.generate_pinterest_seo(title or 'Gig', desc or '', about_text, primary_kw)
+        result['pinterest_seo'] = self.generate_pinterest_seo(title or 'Gig', desc or '', about_text, primary_kw, budget)
+        # fields that fell back to templates because the deadline was hit
+        result['degraded'] = budget.degraded
         return result
 
-    def generate_prompt(self, title, description, refs):
+    def extract_title(self, html:str) -> str:
+        """Gig title from the first <h1> of the page."""
+        title_match = re.search(r'<h1[^>]*>(.*?)</h1>', html, re.S)
+        return re.sub('<[^>]+>','', title_match.group(1)).strip() if title_match else ''
+
+    def extract_gig_fields(self, html:str) -> dict:
+        """Regex extraction of description, seller, rating, images and packages from gig HTML."""
+        desc_match = re.search(r'<meta[^>]+name="description"[^>]+content="([^"]+)"', html)
+        desc = desc_match.group(1) if desc_match else ''
+        seller_match = re.search(r'@([A-Za-z0-9_]+)</a>', html)
+        seller = seller_match.group(1) if seller_match else 'seller'
+        rating = re.search(r'(\d\.\d)\s*\(<span[^>]*>(\d+,?\d*)', html)
+        rating_val = float(rating.group(1)) if rating else None
+        reviews = int(rating.group(2).replace(',','')) if rating else None
+        images = re.findall(r'https://fiverr-res\.cloudinary\.com/[^"\']+\.(?:jpg|png)', html)
+        images = [img for img in images if not re.search(r'favicon|pdf_thumb|profile_small', img, re.I)]
+        # one entry per asset: cloudinary transformation variants collapse to the best-sized one
+        images = dedupe_image_variants(images)[:15]
+        packages = re.findall(r'"price":(\d+),"packageName":"(Basic|Standard|Premium)"', html)
+        packages_json = [{"name":p[1],"price":f"${p[0]}"} for p in packages]
+        return {'description': desc, 'seller': seller, 'rating': rating_val, 'reviews': reviews,
+                'images': images, 'packages': packages_json}
+
+    @upstream_span('openai.fiverr_generate_prompt')
+    def generate_prompt(self, title, description, refs, budget:RequestBudget=None):
         refs_txt = ', '.join(refs)
         prompt = f"Create an eye-catching vertical Pinterest Pin (9:16) advertising my creative service titled '{title}'. Use references {refs_txt} to match style. Highlight key benefits from description: {description[:200]} …. Add clear call-to-action 'Order Now'. Luxurious, professional design, sharp typography, high contrast, no watermark. #SORA_PROMPT"
         
@@ -169,12 +324,13 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
             return prompt
             
         try:
-            res = self.openai.chat.completions.create(model=MODEL, messages=[{"role":"user","content":prompt}], temperature=0.8)
+            res = self.chat('image_prompt', budget, 'sora_prompt', messages=[{"role":"user","content":prompt}], temperature=0.8)
             return res.choices[0].message.content.strip()
         except Exception:
             return prompt
 
-    def generate_pinterest_seo(self, gig_title, description, about_text, primary_keyword):
+    @upstream_span('openai.fiverr_generate_pinterest_seo')
+    def generate_pinterest_seo(self, gig_title, description, about_text, primary_keyword, budget:RequestBudget=None):
         """Generate TOP-TIER Pinterest SEO content using best practices."""
         
         prompt = f"""**TASK**: Act as a world-class Pinterest SEO and conversion copywriter. Create a high-click-through-rate Pin for the following creative service.
@@ -216,12 +372,11 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
             result = {}
         else:
             try:
-                resp = self.openai.chat.completions.create(
-                    model=MODEL,
+                resp = self.chat(
+                    'seo', budget, 'pinterest_seo', 25.0,
                     messages=[{"role": "system", "content": "You are a Pinterest SEO expert following instructions precisely."}, {"role": "user", "content": prompt}],
                     response_format={"type": "json_object"},
-                    temperature=0.8,
-                    timeout=25.0
+                    temperature=0.8
                 )
                 result = json.loads(resp.choices[0].message.content)
             except Exception:
@@ -237,14 +392,17 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
         for phrase in banned_phrases:
             desc_txt = desc_txt.lower().replace(phrase, "").strip()
 
-        if _too_similar(desc_txt, description) or len(desc_txt) < 120:
+        if (_too_similar(desc_txt, description) or len(desc_txt) < 120) and not self.openai:
+            desc_txt = f"{primary_keyword.capitalize()}: Get a stunning, professionally made piece for your project. High-quality and delivered fast. Tap to order now!"
+        elif _too_similar(desc_txt, description) or len(desc_txt) < 120:
             try:
                 rewrite_prompt = f"Rewrite this description to be unique and benefit-focused (180-220 chars), starting with '{primary_keyword}'. Context: {description} {about_text}"
-                rewrite_resp = self.openai.chat.completions.create(
-                    model=MODEL,
-                    messages=[{"role":"user", "content": rewrite_prompt}],
-                    temperature=0.9
-                )
+                with span('openai.fiverr_rewrite_description'):
+                    rewrite_resp = self.chat(
+                        'rewrite', budget, 'pinterest_seo',
+                        messages=[{"role":"user", "content": rewrite_prompt}],
+                        temperature=0.9
+                    )
                 desc_txt = rewrite_resp.choices[0].message.content.strip()
             except Exception:
                 desc_txt = f"{primary_keyword.capitalize()}: Get a stunning, professionally made piece for your project. High-quality and delivered fast. Tap to order now!"
@@ -268,11 +426,14 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
         encoded = quote(gig_url, safe='')
         return f"https://go.fiverr.com/visit/?bta={AFFILIATE_BTA}&brand={AFFILIATE_BRAND}&landingPage={encoded}"
 
-    def extract_primary_keyword(self, title:str)->str:
+    @upstream_span('openai.fiverr_extract_primary_keyword')
+    def extract_primary_keyword(self, title:str, budget:RequestBudget=None)->str:
         """Return 1-3 word primary service keyword derived from the gig title."""
         # First, clean the title from standard Fiverr prefixes
         cleaned_title = re.sub(r"^(i will|i'll|i'll|we will)\s+", '', title, flags=re.I).strip()
-        
+        if not self.openai:
+            return ' '.join(cleaned_title.lower().split()[:3])
+
         try:
             prompt = (
                 "From the following creative service title, extract the core service keyword phrase (2-4 words, lowercase). "
@@ -281,7 +442,7 @@ Only output JSON, no other text. Markdown:\n---\n{md}\n---"""
                 "- 'create a stunning saas website ui' -> 'saas website ui'\n"
                 "- 'be your professional video editor' -> 'professional video editor'\n"
                 "Title: " + cleaned_title)
-            resp = self.openai.chat.completions.create(model=MODEL, messages=[{"role":"user","content":prompt}], temperature=0, timeout=10)
+            resp = self.chat('primary_keyword', budget, 'pinterest_seo', 10, messages=[{"role":"user","content":prompt}], temperature=0)
             kw = resp.choices[0].message.content.strip().lower()
             kw = re.sub(r'[^a-zA-Z0-9\s-]', '', kw) # allow hyphens
             # sanity check
@@ -0,0 +1,124 @@
+"""Canonicalization of CDN image URLs so size/format variants of one asset collapse to one.
+
+Understood conventions:
+  * size/format/cache-buster query params (?w=300, ?resize=..., ?v=3) – dropped, w/width
+    read as size; any other query param (?id=...) stays part of the asset key;
+  * raster format variants – name.jpg, name.webp, name.jpg.webp share one key;
+  * Cloudflare image resizing – /cdn-cgi/image/width=600,format=auto/<path or url>;
+  * WordPress uploads (Creative Fabrica) – name-580x387.jpg, name-scaled.jpg, name.jpg.webp;
+  * Cloudinary (fiverr-res.cloudinary.com) – transformation segments such as
+    t_main1,q_auto,f_auto or w_300,h_200,c_fill between the delivery type and the asset path.
+
+dedupe_image_variants() keeps the first-seen order of assets and, per asset, the variant
+closest to IMAGE_TARGET_WIDTH (smallest one at least that wide, else the original, else
+the widest available). Hosts are case-insensitive, paths are not.
+"""
+import os, re
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+IMAGE_TARGET_WIDTH = int(os.getenv('IMAGE_TARGET_WIDTH', '1200'))
+
+_CF_RESIZE = re.compile(r'/cdn-cgi/image/([^/]+)/(.*)$')
+_WP_SIZE = re.compile(r'-(\d{2,5})x(\d{2,5})(?=\.[a-z0-9]+$)', re.I)
+_WP_SCALED = re.compile(r'-scaled(?=\.[a-z0-9]+$)', re.I)
+_DOUBLE_EXT = re.compile(r'(\.(?:jpe?g|png|gif))\.webp$', re.I)
+_FORMAT_EXT = re.compile(r'\.(?:jpe?g|png|webp|avif)$', re.I)
+# Query params that select a size/format/quality of the same asset or only bust caches
+_VARIANT_PARAMS = {'w', 'width', 'h', 'height', 'q', 'quality', 'fm', 'format', 'fit', 'crop', 'resize',
+                   'dpr', 'auto', 'strip', 'ssl', 'lossy', 'zoom', 'v', 'ver', 'version', 'cb', 'ts', '_'}
+# Cloudinary transformation parameter keys (w_300, t_main1, q_auto, ...)
+_CLOUDINARY_PARAMS = {'a', 'ac', 'ar', 'b', 'bo', 'br', 'c', 'co', 'cs', 'dn', 'dpr', 'du', 'e', 'eo', 'f', 'fl',
+                      'fn', 'fps', 'g', 'h', 'if', 'ki', 'l', 'o', 'pg', 'q', 'r', 'so', 'sp', 't', 'u', 'vc',
+                      'w', 'x', 'y', 'z'}
+_CLOUDINARY_PREFIXES = {'images', 'image', 'video', 'upload', 'fetch'}
+_CLOUDINARY_VERSION = re.compile(r'^v\d+$')
+# Cloudinary named transformations that are known thumbnails
+_CLOUDINARY_SMALL = re.compile(r'thumb|small|profile|card|mobile', re.I)
+
+
+def _cloudinary_segment(segment:str) -> bool:
+    tokens = [token.partition('_') for token in segment.split(',')] if segment else []
+    return bool(tokens) and all(key in _CLOUDINARY_PARAMS and sep and value for key, sep, value in tokens)
+
+
+def canonical_image(url:str):
+    """Return (canonical key, width or None) for an image URL.
+    width None means the untransformed original."""
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    path = parsed.path
+    width = None
+
+    query = parse_qsl(parsed.query, keep_blank_values=True)
+    for name, value in query:
+        if name.lower() in ('w', 'width') and value.isdigit():
+            width = int(value)
+    kept_query = sorted((name, value) for name, value in query if name.lower() not in _VARIANT_PARAMS)
+
+    m = _CF_RESIZE.search(path)
+    if m:
+        options = dict(opt.split('=', 1) for opt in m.group(1).split(',') if '=' in opt)
+        if options.get('width', '').isdigit():
+            width = int(options['width'])
+        inner = m.group(2)
+        if inner.startswith('http'):
+            # proxies may collapse "https://" to "https:/"
+            inner_parsed = urlparse(re.sub(r'^(https?):/+', r'\1://', inner))
+            host, path = inner_parsed.netloc.lower(), inner_parsed.path
+        else:
+            path = '/' + inner
+
+    if 'cloudinary.com' in host:
+        segments = path.split('/')
+        kept = []
+        for i, segment in enumerate(segments):
+            # delivery prefixes (/images/, /image/upload/) and version folders (v1599...) do not identify the asset
+            if i < len(segments) - 1 and (segment in _CLOUDINARY_PREFIXES or _CLOUDINARY_VERSION.match(segment)):
+                continue
+            if _cloudinary_segment(segment):
+                for token in segment.split(','):
+                    if token.startswith('w_') and token[2:].isdigit():
+                        width = int(token[2:])
+                    elif token.startswith('t_') and width is None and _CLOUDINARY_SMALL.search(token):
+                        width = 300
+                continue
+            kept.append(segment)
+        path = '/'.join(kept)
+
+    path = _DOUBLE_EXT.sub(r'\1', path)
+    m = _WP_SIZE.search(path)
+    if m:
+        width = width or int(m.group(1))
+        path = path[:m.start()] + path[m.end():]
+    path = _WP_SCALED.sub('', path)
+    path = _FORMAT_EXT.sub('', path)
+
+    key = f'{host}{path}'
+    if kept_query:
+        key += '?' + urlencode(kept_query)
+    return key, width
+
+
+def _rank(width, target:int):
+    """Lower is better: smallest variant >= target, then the original, then widest below target."""
+    if width is None:
+        return (1, 0)
+    if width >= target:
+        return (0, width)
+    return (2, -width)
+
+
+def dedupe_image_variants(urls, target_width:int=IMAGE_TARGET_WIDTH):
+    """Collapse variants of the same asset, keeping first-seen asset order."""
+    best = {}
+    order = []
+    for url in urls:
+        if not url:
+            continue
+        key, width = canonical_image(url)
+        if key not in best:
+            best[key] = (url, width)
+            order.append(key)
+        elif _rank(width, target_width) < _rank(best[key][1], target_width):
+            best[key] = (url, width)
+    return [best[key][0] for key in order]
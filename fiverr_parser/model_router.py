@@ -0,0 +1,243 @@
+"""Task-aware routing of chat completions across models/endpoints.
+
+Every OpenAI call names its task (name_description, primary_keyword, seo, pinterest_json,
+image_prompt, rewrite, structured_extract). OPENAI_ROUTES maps tasks to an ordered list
+of routes, either as inline JSON or as a path to a JSON file:
+
+    {
+      "default": [{"model": "gpt-4o-mini"}],
+      "primary_keyword": [
+        {"model": "gpt-4o-mini", "latency_target": 3},
+        {"model": "gpt-4o-mini", "base_url": "https://api.openai.com/v1", "api_key_env": "OPENAI_FALLBACK_KEY"}
+      ]
+    }
+
+Route keys: model, base_url, api_key_env (name of the env var holding the key) and
+latency_target (seconds). Missing keys fall back to the parser's own OPENAI_* settings,
+so without OPENAI_ROUTES every task uses the single configured model as before.
+
+Each route keeps a rolling window of latencies and errors. Routes that are failing or
+slower than their target are tried last. If the active attempt has not answered within
+its latency target, the next route is started in parallel (hedge) and the first success
+wins; an error fails over to the next route immediately.
+"""
+import json, os, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from openai import OpenAI, APITimeoutError
+
+OPENAI_ROUTES = os.getenv('OPENAI_ROUTES', '')
+ROUTE_WINDOW = int(os.getenv('ROUTE_WINDOW', '50'))
+ROUTE_LATENCY_TARGET = float(os.getenv('ROUTE_LATENCY_TARGET', '15'))
+ROUTE_MAX_ERROR_RATE = float(os.getenv('ROUTE_MAX_ERROR_RATE', '0.5'))
+ROUTE_HEDGE_WORKERS = int(os.getenv('ROUTE_HEDGE_WORKERS', '16'))
+# rolling stats are trusted only after this many calls
+ROUTE_MIN_SAMPLES = 5
+
+
+def load_routes_config(raw:str=OPENAI_ROUTES) -> dict:
+    """Parse OPENAI_ROUTES (inline JSON or a path to a JSON file); {} when unset or invalid."""
+    if not raw:
+        return {}
+    try:
+        if raw.lstrip().startswith('{'):
+            return json.loads(raw)
+        with open(raw, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f'Invalid OPENAI_ROUTES, using the default model for every task: {str(e)}')
+        return {}
+
+
+class Route:
+    """One model on one endpoint, with rolling latency/error statistics."""
+    def __init__(self, client, model:str, base_url:str, latency_target:float, api_key_env:str=''):
+        self.client = client
+        self.model = model
+        self.name = f'{model}@{urlparse(base_url).netloc or base_url}'
+        # unique per (model, base_url, api_key_env, latency_target), like the route registry key
+        parsed = urlparse(base_url)
+        self.id = f'{model}@{parsed.netloc}{parsed.path.rstrip("/")}' if parsed.netloc else self.name
+        self.id += f' target={latency_target:g}s' + (f' key={api_key_env}' if api_key_env else '')
+        self.latency_target = latency_target
+        self.samples = deque(maxlen=ROUTE_WINDOW)   # (latency seconds, ok)
+        self.counters = {'calls': 0, 'errors': 0, 'hedges': 0, 'failovers': 0, 'wins': 0}
+        self.lock = threading.Lock()
+
+    def call(self, timeout:float, kwargs:dict):
+        if self.client is None:
+            # missing configuration, not an endpoint failure: not recorded in the route stats
+            raise RuntimeError(f'OpenAI client for route {self.name} is not configured')
+        started = time.monotonic()
+        try:
+            response = self.client.with_options(max_retries=0).chat.completions.create(
+                model=self.model, timeout=timeout, **kwargs)
+        except Exception:
+            self.record(time.monotonic() - started, False)
+            raise
+        self.record(time.monotonic() - started, True)
+        return response
+
+    def record(self, latency:float, ok:bool):
+        with self.lock:
+            self.samples.append((latency, ok))
+            self.counters['calls'] += 1
+            if not ok:
+                self.counters['errors'] += 1
+
+    def count(self, key:str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def _percentile(self, latencies, q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+    def healthy(self) -> bool:
+        with self.lock:
+            samples = list(self.samples)
+        if len(samples) < ROUTE_MIN_SAMPLES:
+            return True
+        error_rate = sum(1 for _, ok in samples if not ok) / len(samples)
+        p50 = self._percentile(sorted(l for l, ok in samples if ok), 0.5)
+        return error_rate < ROUTE_MAX_ERROR_RATE and (p50 is None or p50 <= self.latency_target)
+
+    def stats(self) -> dict:
+        with self.lock:
+            samples = list(self.samples)
+            counters = dict(self.counters)
+        latencies = sorted(l for l, ok in samples if ok)
+        p50, p95 = self._percentile(latencies, 0.5), self._percentile(latencies, 0.95)
+        return dict(counters,
+                    name=self.name,
+                    model=self.model,
+                    latency_target=self.latency_target,
+                    window=len(samples),
+                    error_rate=round(sum(1 for _, ok in samples if not ok) / len(samples), 3) if samples else 0.0,
+                    p50_ms=round(p50 * 1000) if p50 is not None else None,
+                    p95_ms=round(p95 * 1000) if p95 is not None else None,
+                    healthy=self.healthy())
+
+
+# Routes are shared between routers (both parsers), so stats aggregate per endpoint+model
+_routes = {}
+_routes_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=ROUTE_HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+
+
+def route_stats() -> dict:
+    """Rolling stats of every route created so far, keyed by route id."""
+    with _routes_lock:
+        routes = list(_routes.values())
+    return {route.id: route.stats() for route in routes}
+
+
+class ModelRouter:
+    """Picks routes for a task and runs the completion with hedging/failover."""
+    def __init__(self, default_client, default_model:str, default_base_url:str, default_api_key:str):
+        self.default_client = default_client
+        self.default_model = default_model
+        self.default_base_url = default_base_url
+        self.default_api_key = default_api_key
+        self.config = load_routes_config()
+        self.tables = {}
+
+    def _route(self, spec:dict) -> Route:
+        model = spec.get('model') or self.default_model
+        base_url = spec.get('base_url') or self.default_base_url
+        api_key_env = spec.get('api_key_env', '')
+        latency_target = float(spec.get('latency_target', ROUTE_LATENCY_TARGET))
+        key = (model, base_url, api_key_env, latency_target)
+        with _routes_lock:
+            if key not in _routes:
+                if base_url == self.default_base_url and not api_key_env:
+                    client = self.default_client
+                else:
+                    try:
+                        client = OpenAI(api_key=os.getenv(api_key_env, '') if api_key_env else self.default_api_key,
+                                        base_url=base_url)
+                    except Exception as e:
+                        # e.g. the api_key_env variable is unset: the route is tried last and fails over
+                        print(f'OpenAI client for {model}@{base_url} is not configured: {str(e)}')
+                        client = None
+                _routes[key] = Route(client, model, base_url, latency_target, api_key_env)
+            return _routes[key]
+
+    def routes_for(self, task:str) -> list:
+        """Routes for a task: healthy ones in configured order, then unhealthy ones,
+        then routes without a client (e.g. api_key_env unset)."""
+        if task not in self.tables:
+            specs = self.config.get(task) or self.config.get('default') or [{}]
+            self.tables[task] = [self._route(spec) for spec in specs]
+        routes = [r for r in self.tables[task] if r.client is not None]
+        unconfigured = [r for r in self.tables[task] if r.client is None]
+        return [r for r in routes if r.healthy()] + [r for r in routes if not r.healthy()] + unconfigured
+
+    def complete(self, task:str, budget=None, fields=(), cap:float=60.0, **kwargs):
+        """chat.completions.create for a task, bounded by the request budget.
+        Raises the last error if every route failed; timeouts mark `fields` degraded."""
+        routes = self.routes_for(task)
+        try:
+            if len(routes) == 1:
+                timeout = budget.stage_timeout(cap, fields) if budget else cap
+                return routes[0].call(timeout, kwargs)
+            return self._hedged(routes, budget, fields, cap, kwargs)
+        except APITimeoutError:
+            if budget:
+                budget.degrade(fields)
+            raise
+
+    def _attempt(self, route, attempt, budget, fields, cap, kwargs):
+        """One hedged attempt, run on a pool worker. The timeout is taken from the budget only
+        now, so time spent waiting for a free worker is charged against the request deadline."""
+        attempt['started'] = time.monotonic()
+        timeout = budget.stage_timeout(cap, fields) if budget else cap
+        return route.call(timeout, kwargs)
+
+    def _hedged(self, routes, budget, fields, cap, kwargs):
+        pending = {}
+        last_error = None
+        next_index = 0
+
+        def launch(reason=None):
+            nonlocal next_index
+            route = routes[next_index]
+            next_index += 1
+            if reason:
+                route.count(reason)
+            attempt = {'route': route, 'started': None}
+            pending[_executor.submit(self._attempt, route, attempt, budget, fields, cap, kwargs)] = attempt
+            return attempt
+
+        def running_for(attempt):
+            return time.monotonic() - attempt['started'] if attempt['started'] else 0.0
+
+        def can_launch():
+            return next_index < len(routes) and not (budget and budget.remaining() <= 0)
+
+        active = launch()
+        while pending:
+            wait_for = None
+            if can_launch():
+                # the hedge timer starts when the attempt runs, not while it is queued for a worker
+                wait_for = max(0.0, active['route'].latency_target - running_for(active))
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            failed = False
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    failed = True
+                    continue
+                attempt['route'].count('wins')
+                return response
+            if not can_launch():
+                continue
+            # error -> fail over; primary still running past its target -> hedge
+            if failed:
+                active = launch('failovers')
+            elif active['started'] and running_for(active) >= active['route'].latency_target:
+                active = launch('hedges')
+        raise last_error
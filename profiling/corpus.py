@@ -0,0 +1,48 @@
+"""Versioned local corpus of raw scrape payloads.
+
+When CORPUS_RECORD_DIR is set, the parsers save every raw Firecrawl/Apify payload
+to <CORPUS_RECORD_DIR>/v<CORPUS_VERSION>/<source>/<sha1(url)>.json so the extraction
+stages can later be replayed offline (see profiling/replay.py).
+"""
+import hashlib, json, os, time
+
+CORPUS_RECORD_DIR = os.getenv('CORPUS_RECORD_DIR', '')
+# Bump when the record layout changes so old and new corpora never mix
+CORPUS_VERSION = 1
+
+
+def record_payload(source:str, url:str, payload):
+    """Save one raw payload to the corpus. No-op unless CORPUS_RECORD_DIR is set."""
+    if not CORPUS_RECORD_DIR or not payload:
+        return None
+    try:
+        folder = os.path.join(CORPUS_RECORD_DIR, f'v{CORPUS_VERSION}', source)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+        record = {'version': CORPUS_VERSION, 'source': source, 'url': url,
+                  'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'payload': payload}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        print(f'Corpus record error for {url}: {str(e)}')
+        return None
+
+
+def iter_corpus(corpus_dir:str):
+    """Yield records of a corpus version directory (e.g. corpus/v1) in a stable order."""
+    for source in sorted(os.listdir(corpus_dir)):
+        folder = os.path.join(corpus_dir, source)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(folder, name), encoding='utf-8') as f:
+                record = json.load(f)
+            if record.get('version') != CORPUS_VERSION:
+                continue
+            record['id'] = f'{source}/{name[:-5]}'
+            yield record
@@ -0,0 +1,132 @@
+"""Peak-memory benchmark of the scrape stage under concurrent parses.
+
+Usage (from the project root):
+    python -m profiling.memory_bench [--threads 50] [--size-mb 4] [--decoder both|ijson|json]
+
+Firecrawl and Apify are replaced by in-process fakes that stream a synthetic multi-MB
+JSON body in 64 KB chunks, so no network or API keys are needed. N threads run
+FontWebParser.firecrawl_scrape and FiverrParser.apify_fetch at once and the script
+reports the tracemalloc peak and the process peak RSS. With --decoder both each decoder
+runs in its own subprocess (peak RSS is per process): `json` decodes the whole body
+as before, `ijson` builds only the fields the extractors read.
+
+tracemalloc sees Python allocations only; ijson's C backend buffers show up in RSS.
+"""
+import argparse, json, os, resource, subprocess, sys, threading, time, tracemalloc
+from unittest import mock
+
+
+def make_page(size_mb:float) -> str:
+    """Product-page-like HTML: mostly script/markup noise with a few image tags."""
+    block = ('<div class="row"><script>window.__STATE__={"k":"' + 'x' * 900 + '"}</script>'
+             '<img src="https://www.creativefabrica.com/wp-content/uploads/2024/01/glyph-580x387.jpg"></div>\n')
+    return block * max(1, int(size_mb * 1024 * 1024 / len(block)))
+
+
+def make_bodies(size_mb:float):
+    html = make_page(size_mb / 2)
+    firecrawl = json.dumps({'success': True, 'data': {
+        'html': html, 'markdown': html[:len(html) // 2], 'images': [],
+        'metadata': {'title': 'Bench Font', 'statusCode': 200}}}).encode('utf-8')
+    apify = json.dumps([{'url': 'https://www.fiverr.com/bench/gig', 'html': html, 'markdown': html[:len(html) // 2]},
+                        {'url': 'https://www.fiverr.com/bench/other', 'html': html}]).encode('utf-8')
+    return firecrawl, apify
+
+
+class FakeResponse:
+    """Just enough of requests.Response for the streaming readers."""
+    status_code = 200
+    encoding = 'utf-8'
+
+    def __init__(self, body:bytes):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        view = memoryview(self.body)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+
+
+def run(decoder:str, threads:int, size_mb:float) -> dict:
+    import app
+    from fiverr_parser import fiverr_parser
+    if decoder == 'json':
+        app.ijson = None
+        fiverr_parser.ijson = None
+    elif app.ijson is None:
+        raise SystemExit('ijson is not installed')
+
+    firecrawl_body, apify_body = make_bodies(size_mb)
+    font_parser, gig_parser = app.FontWebParser(), fiverr_parser.FiverrParser()
+
+    def fake_post(url, *args, **kwargs):
+        return FakeResponse(apify_body if 'apify.com' in url else firecrawl_body)
+
+    results = []
+    start = threading.Barrier(threads)
+
+    def worker(i):
+        start.wait()
+        if i % 2:
+            data = gig_parser.apify_fetch(f'https://www.fiverr.com/bench/gig-{i}')
+        else:
+            data = font_parser.firecrawl_scrape(f'https://www.creativefabrica.com/product/bench-{i}/')
+        results.append(bool(data and data.get('html')))
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with mock.patch.object(app.requests, 'post', fake_post), \
+         mock.patch.object(fiverr_parser.requests, 'post', fake_post):
+        tracemalloc.start()
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {'decoder': decoder, 'threads': threads, 'body_mb': round(len(firecrawl_body) / 1e6, 1),
+            'ok': sum(results), 'seconds': round(elapsed, 2), 'tracemalloc_peak_mb': round(peak / 1e6, 1),
+            # ru_maxrss is KB on Linux; the delta excludes imports and the prebuilt bodies
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'rss_delta_mb': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024, 1)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Peak memory of concurrent scrape decoding with mocked upstreams.')
+    ap.add_argument('--threads', type=int, default=50, help='concurrent parses (default: 50)')
+    ap.add_argument('--size-mb', type=float, default=4, help='approximate response body size in MB (default: 4)')
+    ap.add_argument('--decoder', choices=['both', 'ijson', 'json'], default='both')
+    args = ap.parse_args(argv)
+
+    if args.decoder != 'both':
+        print(json.dumps(run(args.decoder, args.threads, args.size_mb)))
+        return 0
+
+    rows = []
+    for decoder in ('json', 'ijson'):
+        out = subprocess.run([sys.executable, '-m', 'profiling.memory_bench', '--decoder', decoder,
+                              '--threads', str(args.threads), '--size-mb', str(args.size_mb)],
+                             capture_output=True, text=True, cwd=os.getcwd())
+        if out.returncode != 0:
+            print(out.stderr, file=sys.stderr)
+            return out.returncode
+        rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'decoder':<10}{'threads':>8}{'body MB':>10}{'ok':>6}{'seconds':>10}{'tracemalloc MB':>16}{'peak RSS MB':>14}{'RSS delta MB':>14}")
+    for r in rows:
+        print(f"{r['decoder']:<10}{r['threads']:>8}{r['body_mb']:>10}{r['ok']:>6}{r['seconds']:>10}"
+              f"{r['tracemalloc_peak_mb']:>16}{r['peak_rss_mb']:>14}{r['rss_delta_mb']:>14}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
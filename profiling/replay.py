@@ -0,0 +1,150 @@
+"""Offline replay of a recorded scrape corpus through the CPU-side extraction stages.
+
+Usage (from the project root):
+    python -m profiling.replay corpus/v1 [--repeat 5] [--profile replay.prof]
+                                         [--output out.jsonl] [--diff baseline.jsonl]
+
+Prints per-extractor throughput, optionally writes a cProfile dump (open it with
+snakeviz or render a flamegraph with flameprof) and diffs extractor outputs against
+an --output file written by an earlier code version.
+"""
+import argparse, cProfile, json, pstats, sys, time
+from urllib.parse import urlparse
+
+from app import FontWebParser
+from fiverr_parser.fiverr_parser import FiverrParser
+from profiling.corpus import iter_corpus
+
+FONT_SOURCES = ('firecrawl',)
+FIVERR_SOURCES = ('apify', 'fiverr_get')
+
+
+class StageTimer:
+    """Accumulates call count, wall time and input volume per extractor."""
+    def __init__(self):
+        self.stats = {}
+
+    def run(self, name, func, *args, size=0):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        stat = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'bytes': 0})
+        stat['calls'] += 1
+        stat['seconds'] += elapsed
+        stat['bytes'] += size
+        return result
+
+    def report(self):
+        lines = [f"{'extractor':<32}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'calls/s':>12}{'MB/s':>10}"]
+        for name, s in sorted(self.stats.items(), key=lambda kv: -kv[1]['seconds']):
+            seconds = s['seconds'] or 1e-9
+            lines.append(f"{name:<32}{s['calls']:>8}{s['seconds'] * 1000:>12.1f}"
+                         f"{s['seconds'] * 1000 / s['calls']:>10.3f}{s['calls'] / seconds:>12.1f}"
+                         f"{s['bytes'] / seconds / 1e6:>10.1f}")
+        return '\n'.join(lines)
+
+
+def font_name_from_url(url):
+    """Font name guess from the product slug (the live parser gets it from the LLM)."""
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    slug = parts[parts.index('product') + 1] if 'product' in parts and parts.index('product') + 1 < len(parts) else ''
+    return slug.replace('-', ' ')
+
+
+def replay_font(font_parser, timer, record):
+    raw = record['payload']
+    size = len(raw.get('html', '') or '') + len(raw.get('markdown', '') or '')
+    data = timer.run('font.compact_scrape_data', font_parser.compact_scrape_data, raw, size=size)
+    compact_size = len(data['html']) + len(data['markdown'])
+    return {
+        'main_preview': timer.run('font.extract_main_preview_image', font_parser.extract_main_preview_image, data, size=compact_size),
+        'glyph_images': timer.run('font.extract_all_glyph_images', font_parser.extract_all_glyph_images, data, size=compact_size),
+        'font_style': timer.run('font.analyze_font_style', font_parser.analyze_font_style, font_name_from_url(record['url'])),
+    }
+
+
+def replay_fiverr(gig_parser, timer, record):
+    raw = record['payload']
+    html = raw.get('html', '') or ''
+    md = raw.get('markdown', '') or ''
+    html = timer.run('fiverr.slim_html', gig_parser.slim_html, html, size=len(html))
+    return {
+        'title': timer.run('fiverr.extract_title', gig_parser.extract_title, html, size=len(html)),
+        'fields': timer.run('fiverr.extract_gig_fields', gig_parser.extract_gig_fields, html, size=len(html)),
+        'about': timer.run('fiverr.extract_about_section', gig_parser.extract_about_section, html, md, size=len(html) + len(md)),
+    }
+
+
+def diff_outputs(baseline_path, outputs):
+    """Print records whose extractor outputs differ from the baseline run."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {row['id']: row['output'] for row in map(json.loads, f)}
+    changed = 0
+    for record_id, output in outputs.items():
+        old = baseline.get(record_id)
+        if old is None:
+            print(f'+ {record_id}: new record')
+            changed += 1
+            continue
+        for key in sorted(set(old) | set(output)):
+            if old.get(key) != output.get(key):
+                print(f'~ {record_id} [{key}]\n    - {json.dumps(old.get(key), ensure_ascii=False)}\n    + {json.dumps(output.get(key), ensure_ascii=False)}')
+                changed += 1
+    for record_id in baseline.keys() - outputs.keys():
+        print(f'- {record_id}: missing from this run')
+        changed += 1
+    print(f'{changed} difference(s) against {baseline_path}')
+    return changed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Replay a recorded scrape corpus through the extractors.')
+    ap.add_argument('corpus', help='corpus version directory, e.g. corpus/v1')
+    ap.add_argument('--repeat', type=int, default=1, help='replay the corpus N times for steadier timings')
+    ap.add_argument('--profile', help='write a cProfile dump to this path')
+    ap.add_argument('--output', help='write extractor outputs as JSONL (input for --diff)')
+    ap.add_argument('--diff', help='JSONL written by --output of an earlier code version')
+    args = ap.parse_args(argv)
+
+    records = list(iter_corpus(args.corpus))
+    if not records:
+        print(f'No records found in {args.corpus}')
+        return 1
+
+    font_parser, gig_parser, timer = FontWebParser(), FiverrParser(), StageTimer()
+    profiler = cProfile.Profile() if args.profile else None
+    outputs = {}
+
+    started = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    for _ in range(args.repeat):
+        for record in records:
+            if record['source'] in FONT_SOURCES:
+                outputs[record['id']] = replay_font(font_parser, timer, record)
+            elif record['source'] in FIVERR_SOURCES:
+                outputs[record['id']] = replay_fiverr(gig_parser, timer, record)
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - started
+
+    print(f'Replayed {len(records)} record(s) x{args.repeat} in {elapsed:.2f}s\n')
+    print(timer.report())
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print(f'\ncProfile dump: {args.profile} (snakeviz {args.profile} / flameprof {args.profile} > flame.svg)\n')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for record_id, output in outputs.items():
+                f.write(json.dumps({'id': record_id, 'output': output}, ensure_ascii=False) + '\n')
+
+    if args.diff:
+        return 1 if diff_outputs(args.diff, outputs) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Opt-in sampling profiler for a single /parse or /parse_fiverr request.
+
+A request is profiled only when PROFILE_TOKEN is set and the request carries the same
+token in the X-Profile header (not the query string, which ends up in access logs).
+The profiler samples the stack of the request thread every PROFILE_INTERVAL_MS from
+a helper thread and records wall-clock
+spans of upstream calls marked with @upstream_span / span(). The resulting trace is
+speedscope JSON (https://www.speedscope.app) kept in memory (last PROFILE_KEEP traces)
+and, if PROFILE_DIR is set, written to disk.
+
+When no profiler is active, upstream_span/span cost one thread-local lookup.
+"""
+import contextlib, functools, json, os, sys, threading, time, uuid
+from collections import OrderedDict
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '20'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+
+_active = threading.local()
+_null_span = contextlib.nullcontext()
+
+
+class RequestProfiler:
+    """Samples one thread's stack and records upstream spans while active."""
+    def __init__(self, name:str):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.frames = []
+        self.frame_index = {}
+        self.samples = []
+        self.weights = []
+        self.spans = []
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f'profiler-{self.id}', daemon=True)
+        _active.profiler = self
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        _active.profiler = None
+        self.cpu_seconds = time.thread_time() - self.cpu_start
+        self.end = time.perf_counter()
+        self._stop.set()
+        self._sampler.join()
+        return False
+
+    def _frame_id(self, code, line):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        if key not in self.frame_index:
+            self.frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return self.frame_index[key]
+
+    def _sample_loop(self):
+        interval = PROFILE_INTERVAL_MS / 1000.0
+        last = time.perf_counter()
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append((now - last) * 1000.0)
+            last = now
+
+    @contextlib.contextmanager
+    def span(self, name:str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append({'name': name,
+                               'start_ms': (started - self.start) * 1000.0,
+                               'duration_ms': (time.perf_counter() - started) * 1000.0})
+
+    def speedscope(self):
+        """Trace in speedscope file format: sampled stacks plus an evented profile of spans."""
+        frames = list(self.frames)
+        span_frames = {}
+        events, open_spans = [], []
+        for s in sorted(self.spans, key=lambda s: (s['start_ms'], -s['duration_ms'])):
+            if s['name'] not in span_frames:
+                span_frames[s['name']] = len(frames)
+                frames.append({'name': s['name']})
+            # closing spans that ended before this one starts keeps open/close events nested
+            while open_spans and open_spans[-1][1] <= s['start_ms']:
+                frame, end = open_spans.pop()
+                events.append({'type': 'C', 'frame': frame, 'at': end})
+            events.append({'type': 'O', 'frame': span_frames[s['name']], 'at': s['start_ms']})
+            open_spans.append((span_frames[s['name']], s['start_ms'] + s['duration_ms']))
+        while open_spans:
+            frame, end = open_spans.pop()
+            events.append({'type': 'C', 'frame': frame, 'at': end})
+        end_ms = (self.end - self.start) * 1000.0
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'font-parser request_profiler',
+            'shared': {'frames': frames},
+            'profiles': [
+                {'type': 'sampled', 'name': f'{self.name} (stack samples)', 'unit': 'milliseconds',
+                 'startValue': 0, 'endValue': end_ms, 'samples': self.samples, 'weights': self.weights},
+                {'type': 'evented', 'name': f'{self.name} (upstream calls)', 'unit': 'milliseconds',
+                 'startValue': 0, 'endValue': end_ms, 'events': events},
+            ],
+        }
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+            'wall_ms': round((self.end - self.start) * 1000.0, 1),
+            'cpu_ms': round(self.cpu_seconds * 1000.0, 1),
+            'samples': len(self.samples),
+            'spans': [{k: round(v, 1) if isinstance(v, float) else v for k, v in s.items()} for s in self.spans],
+        }
+
+
+def span(name:str):
+    """Context manager recording an upstream call span on the active profiler (no-op otherwise)."""
+    profiler = getattr(_active, 'profiler', None)
+    return profiler.span(name) if profiler else _null_span
+
+
+def upstream_span(name:str):
+    """Decorator form of span() for methods that wrap a single upstream call."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = getattr(_active, 'profiler', None)
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_store = OrderedDict()
+_store_lock = threading.Lock()
+
+
+def save_profile(profiler:RequestProfiler):
+    """Keep the trace in memory (and on disk if PROFILE_DIR is set); returns the profile id."""
+    record = {'summary': profiler.summary(), 'speedscope': profiler.speedscope()}
+    with _store_lock:
+        _store[profiler.id] = record
+        while len(_store) > PROFILE_KEEP:
+            _store.popitem(last=False)
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f'{profiler.id}.speedscope.json'), 'w', encoding='utf-8') as f:
+                json.dump(record['speedscope'], f)
+        except Exception as e:
+            print(f'Profile save error: {str(e)}')
+    return profiler.id
+
+
+def list_profiles():
+    with _store_lock:
+        return [r['summary'] for r in reversed(_store.values())]
+
+
+def get_profile(profile_id:str):
+    with _store_lock:
+        record = _store.get(profile_id)
+    if record is None and PROFILE_DIR:
+        path = os.path.join(PROFILE_DIR, f'{os.path.basename(profile_id)}.speedscope.json')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+    return record['speedscope'] if record else None